@@ -1,37 +1,240 @@
 import argparse
-import csv
-import json
 import os
 import datetime
+import mmap
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import NamedTuple
+
+import orjson
+import pandas as pd
+
+try:
+    from rbloom import Bloom
+except ImportError:
+    Bloom = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 # --- Configuration ---
 # Defaults
 DEFAULT_INPUT_JSON = r"data/processed/books_enriched.jsonl"
 DEFAULT_INPUT_CSV = r"data/raw/Accession Register-Books.csv"
-DEFAULT_OUTPUT_TRANSFORMED = r"data/processed/Google_cleaned.jsonl"
 DEFAULT_OUTPUT_DEDUPED = r"data/processed/google_deduped.jsonl"
 LOG_FILE = r"logs/project_log.md"
 
+# Accession register columns merged into each record
+CSV_METADATA_COLUMNS = {
+    "Ed./Vol.": "edition_volume",
+    "Place & Publisher": "publisher_info",
+    "Class No./Book No.": "book_no"
+}
+
+# Output buffer size for the JSONL writer
+WRITE_BUFFER_SIZE = 1 << 20
+# Lines handed to a transform worker at a time
+TRANSFORM_BATCH_SIZE = 1000
+
+# Dedup switches from sets to Bloom filters (if rbloom is installed) at this scale
+BLOOM_MIN_RECORDS = 1_000_000
+BLOOM_ERROR_RATE = 1e-9
+
+def iter_jsonl_lines(path):
+    """
+    Yields raw (bytes) lines from a JSONL file through a read-only memory map.
+    Pages are loaded lazily by the kernel; each line is sliced straight from the map.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = 0
+            size = len(mm)
+            while pos < size:
+                nl = mm.find(b"\n", pos)
+                if nl == -1:
+                    nl = size
+                yield mm[pos:nl]
+                pos = nl + 1
+
+def make_seen_set(expected_records=None):
+    """
+    Returns the container used to remember seen IDs during dedup.
+    A plain set for the current dataset size; a Bloom filter for very large inputs.
+    """
+    if Bloom is not None and expected_records and expected_records >= BLOOM_MIN_RECORDS:
+        return Bloom(expected_records * 2, BLOOM_ERROR_RATE)
+    return set()
+
+def hashed_dedup_key(value):
+    return xxhash.xxh3_64_intdigest(value.encode())
+
+def make_dedup_key(expected_records=None):
+    """
+    Returns the function mapping an ID to the key stored in the seen-ID containers.
+    The ID string itself for the current dataset size; for very large inputs (same
+    threshold as the Bloom filter) a 64-bit xxh3 int, which keeps the sets smaller.
+    """
+    if xxhash is not None and expected_records and expected_records >= BLOOM_MIN_RECORDS:
+        return hashed_dedup_key
+    return str
+
+class JsonlWriter:
+    """Buffers serialized (orjson) records in a bytearray and writes them out in ~1 MiB chunks."""
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.buffer = bytearray()
+
+    def write_raw(self, payload):
+        """Appends an already serialized record."""
+        self.buffer += payload
+        self.buffer += b"\n"
+        if len(self.buffer) >= WRITE_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.outfile.write(self.buffer)
+            self.buffer.clear()
+
+class CsvMetadata(NamedTuple):
+    """Accession-register metadata as parallel columns, with a key -> row position index."""
+    index: dict
+    edition_volume: list
+    publisher_info: list
+    book_no: list
+
+EMPTY_CSV_METADATA = CsvMetadata({}, [], [], [])
+
+def acc_key(acc_no):
+    """
+    Key for the accession-number lookup. Canonical numeric values become ints (cheaper to hash);
+    anything else, including zero-padded numbers, stays a string so distinct values never collide.
+    """
+    if acc_no.isascii() and acc_no.isdigit() and acc_no[0] != "0":
+        return int(acc_no)
+    return acc_no
+
 def load_csv_metadata(input_csv):
     print(f"Loading metadata from {input_csv}...")
-    metadata_map = {}
     try:
-        with open(input_csv, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                acc_no = row.get("Acc. No.", "").strip()
-                if acc_no:
-                    metadata_map[str(acc_no)] = {
-                        "edition_volume": row.get("Ed./Vol.", "").strip(),
-                        "publisher_info": row.get("Place & Publisher", "").strip(),
-                        "book_no": row.get("Class No./Book No.", "").strip()
-                    }
+        columns = ["Acc. No.", *CSV_METADATA_COLUMNS]
+        df = pd.read_csv(input_csv, usecols=lambda c: c in columns, dtype=str, keep_default_na=False, encoding='utf-8')
+        # Missing columns behave like empty cells, as with csv.DictReader
+        df = df.reindex(columns=columns).fillna("")
+        df = df.apply(lambda col: col.str.strip())
+        df = df[df["Acc. No."] != ""].rename(columns=CSV_METADATA_COLUMNS)
+        # Later rows win for repeated accession numbers
+        index = {acc_key(acc_no): i for i, acc_no in enumerate(df["Acc. No."])}
+        return CsvMetadata(
+            index,
+            df["edition_volume"].tolist(),
+            df["publisher_info"].tolist(),
+            df["book_no"].tolist()
+        )
     except Exception as e:
         print(f"Error reading CSV: {e}")
-    return metadata_map
+    return EMPTY_CSV_METADATA
+
+def build_record(record, csv_metadata):
+    """
+    Builds the final record from an enriched one and returns (google_id, isbn_13, serialized record),
+    or None when the record has no Google data.
+    """
+    google_data = record.get("google_book_data", {})
+    if not google_data:
+        return None
+
+    identifiers = {
+        ident['type']: ident['identifier']
+        for ident in google_data.get("industry_identifiers", [])
+    }
+    isbn_13 = identifiers.get('ISBN_13')
+    isbn_10 = identifiers.get('ISBN_10')
+    g_id = google_data.get("google_id")
+    
+    original_id = str(record.get("original_id", "")).strip()
+    i = csv_metadata.index.get(acc_key(original_id), -1)
+    if i >= 0:
+        edition_volume = csv_metadata.edition_volume[i]
+        publisher_info = csv_metadata.publisher_info[i]
+        book_no = csv_metadata.book_no[i]
+    else:
+        edition_volume = publisher_info = book_no = None
+    
+    final_record = {
+        "title": google_data.get("title"),
+        "subtitle": google_data.get("subtitle"),
+        "authors": google_data.get("authors", []),
+        "description": google_data.get("description"),
+        "isbn_13": isbn_13,
+        "isbn_10": isbn_10,
+        "categories": google_data.get("categories", []),
+        "page_count": google_data.get("page_count"),
+        "published_date": google_data.get("published_date"),
+        "thumbnail": google_data.get("thumbnail"),
+        "preview_link": google_data.get("preview_link"),
+        "google_id": g_id,
+        
+        "edition_volume": edition_volume,
+        "publisher_info": publisher_info,
+        "book_no": book_no
+    }
 
-def transform_step(input_json, input_csv, output_transformed):
-    print("\n--- Step 1: Transforming & Merging ---")
+    # orjson emits UTF-8 directly (same as ensure_ascii=False)
+    return g_id, isbn_13, orjson.dumps(final_record)
+
+# CSV metadata of a worker process, set once by the pool initializer
+_worker_csv_metadata = EMPTY_CSV_METADATA
+
+def _init_worker(csv_metadata):
+    global _worker_csv_metadata
+    _worker_csv_metadata = csv_metadata
+
+def transform_batch(lines, csv_metadata=None):
+    """Parses and transforms a batch of raw JSONL lines. Malformed lines are dropped."""
+    if csv_metadata is None:
+        csv_metadata = _worker_csv_metadata
+    results = []
+    for line in lines:
+        try:
+            record = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            continue
+        results.append(build_record(record, csv_metadata))
+    return results
+
+def iter_batches(lines, size):
+    lines = iter(lines)
+    while batch := list(islice(lines, size)):
+        yield batch
+
+def map_bounded(executor, fn, items, window):
+    """
+    Like executor.map, but keeps at most `window` tasks in flight, so the input is
+    consumed only as fast as results are taken (Executor.map submits everything up front).
+    Results are yielded in input order.
+    """
+    items = iter(items)
+    pending = deque(executor.submit(fn, item) for item in islice(items, window))
+    while pending:
+        future = pending.popleft()
+        for item in islice(items, 1):    # refill before waiting, so the window stays full
+            pending.append(executor.submit(fn, item))
+        yield future.result()
+
+def transform_step(input_json, input_csv, output_file, expected_records=None, workers=1):
+    """
+    Transforms, merges and deduplicates the enriched records in a single streaming pass.
+    Duplicates are resolved on Google ID first, then ISBN-13 (first record wins).
+    With workers > 1, parsing and record building run in a process pool on batches of lines;
+    dedup and writing stay in this process, in input order.
+    """
+    print("\n--- Transforming, Merging & Deduplicating ---")
     if not os.path.exists(input_json):
         print(f"Error: Input file {input_json} not found.")
         return False
@@ -42,120 +245,66 @@ def transform_step(input_json, input_csv, output_transformed):
     total_records = 0
     kept_records = 0
     removed_no_isbn = 0 # Actually just 'no google data' now
+    duplicate_records = 0
+    seen_google_ids = make_seen_set(expected_records)
+    seen_isbns = make_seen_set(expected_records)
+    dedup_key = make_dedup_key(expected_records)
     
-    with open(input_json, 'r', encoding='utf-8') as infile, \
-         open(output_transformed, 'w', encoding='utf-8') as outfile:
-        
-        for line in infile:
-            try:
-                record = json.loads(line)
-                total_records += 1
-                
-                google_data = record.get("google_book_data", {})
-                if not google_data:
-                    removed_no_isbn += 1
-                    continue
-
-                identifiers = google_data.get("industry_identifiers", [])
-                
-                isbn_13 = None
-                isbn_10 = None
-                for ident in identifiers:
-                    if ident['type'] == 'ISBN_13':
-                        isbn_13 = ident['identifier']
-                    elif ident['type'] == 'ISBN_10':
-                        isbn_10 = ident['identifier']
-                
-                original_id = str(record.get("original_id", "")).strip()
-                csv_info = csv_metadata.get(original_id, {})
-                
-                final_record = {
-                    "title": google_data.get("title"),
-                    "subtitle": google_data.get("subtitle"),
-                    "authors": google_data.get("authors", []),
-                    "description": google_data.get("description"),
-                    "isbn_13": isbn_13,
-                    "isbn_10": isbn_10,
-                    "categories": google_data.get("categories", []),
-                    "page_count": google_data.get("page_count"),
-                    "published_date": google_data.get("published_date"),
-                    "thumbnail": google_data.get("thumbnail"),
-                    "preview_link": google_data.get("preview_link"),
-                    "google_id": google_data.get("google_id"),
-                    
-                    "edition_volume": csv_info.get("edition_volume"),
-                    "publisher_info": csv_info.get("publisher_info"),
-                    "book_no": csv_info.get("book_no")
-                }
-
-                outfile.write(json.dumps(final_record) + "\n")
-                kept_records += 1
-                
-            except json.JSONDecodeError:
-                continue
+    batches = iter_batches(iter_jsonl_lines(input_json), TRANSFORM_BATCH_SIZE)
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(csv_metadata,))
+        results = map_bounded(executor, transform_batch, batches, 2 * workers)
+    else:
+        results = (transform_batch(batch, csv_metadata) for batch in batches)
 
-    print(f"Transformation processed: {total_records}")
-    print(f"Kept: {kept_records}")
-    return True
+    try:
+        with open(output_file, 'wb') as outfile:
+            writer = JsonlWriter(outfile)
+            
+            for batch in results:
+                for item in batch:
+                    total_records += 1
+                    if item is None:
+                        removed_no_isbn += 1
+                        continue
 
-def dedup_step(input_file, output_file):
-    print("\n--- Step 2: Deduplication ---")
-    if not os.path.exists(input_file):
-        print(f"Error: {input_file} not found.")
-        return
+                    g_id, isbn_13, payload = item
+                    g_key = dedup_key(g_id) if g_id else None
+                    isbn_key = dedup_key(isbn_13) if isbn_13 else None
+                    if (g_key is not None and g_key in seen_google_ids) or \
+                       (isbn_key is not None and isbn_key in seen_isbns):
+                        duplicate_records += 1
+                        continue
+                    if g_key is not None:
+                        seen_google_ids.add(g_key)
+                    if isbn_key is not None:
+                        seen_isbns.add(isbn_key)
 
-    total_records = 0
-    kept_records = 0
-    duplicate_records = 0
-    seen_google_ids = set()
-    seen_isbns = set()
-    
-    with open(input_file, 'r', encoding='utf-8') as infile, \
-         open(output_file, 'w', encoding='utf-8') as outfile:
-        
-        for line in infile:
-            try:
-                record = json.loads(line)
-                total_records += 1
-                g_id = record.get("google_id")
-                isbn = record.get("isbn_13")
-                
-                is_duplicate = False
-                if g_id and g_id in seen_google_ids:
-                    is_duplicate = True
-                elif isbn and isbn in seen_isbns:
-                    is_duplicate = True
-                
-                if is_duplicate:
-                    duplicate_records += 1
-                    continue
-                
-                if g_id:
-                    seen_google_ids.add(g_id)
-                if isbn:
-                    seen_isbns.add(isbn)
-                
-                # unicode fix inline: ensure_ascii=False
-                outfile.write(json.dumps(record, ensure_ascii=False) + "\n")
-                kept_records += 1
-            except json.JSONDecodeError:
-                continue
-
-    print(f"Deduplication processed: {total_records}")
+                    writer.write_raw(payload)
+                    kept_records += 1
+
+            writer.flush()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print(f"Transformation processed: {total_records}")
     print(f"Duplicates removed: {duplicate_records}")
-    print(f"Final Count (google_deduped.jsonl): {kept_records}")
+    print(f"Final Count ({os.path.basename(output_file)}): {kept_records}")
+    return True
 
 def main():
     parser = argparse.ArgumentParser(description="Transform and Deduplicate Book Data")
     parser.add_argument("--input", default=DEFAULT_INPUT_JSON, help="Input enriched JSONL file")
     parser.add_argument("--csv-input", default=DEFAULT_INPUT_CSV, help="Input CSV file for metadata")
-    parser.add_argument("--output", default=DEFAULT_OUTPUT_TRANSFORMED, help="Intermediate transformed output file")
-    parser.add_argument("--dedup-output", default=DEFAULT_OUTPUT_DEDUPED, help="Final deduplicated output file")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_DEDUPED, help="Final deduplicated output file")
+    parser.add_argument("--expected-records", type=int, default=None, help="Approximate input size; enables Bloom-filter dedup for very large inputs")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for parsing/transforming (1 = in-process)")
     
     args = parser.parse_args()
 
-    if transform_step(args.input, args.csv_input, args.output):
-        dedup_step(args.output, args.dedup_output)
+    transform_step(args.input, args.csv_input, args.output, args.expected_records, args.workers)
     print("\nTransformation Pipeline Complete.")
 
 if __name__ == "__main__":
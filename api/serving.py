@@ -1,13 +1,26 @@
 import argparse
-from fastapi import FastAPI, Depends, HTTPException, Query
+import hashlib
+import orjson
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
 
-from sqlalchemy import or_
+from sqlalchemy import select, union_all, func, literal
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
 import os
 import sys
+import time
+import threading
+from collections import OrderedDict
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 
 # Add project root to sys.path
 sys.path.append(os.getcwd())
@@ -22,7 +35,9 @@ if parent_dir not in sys.path:
     sys.path.append(parent_dir)
 
 # Import from storage.db
-from storage.db import Book, SessionLocal, engine, Base
+from storage.db import Book, SessionLocal, init_db, keyword_search, count_keyword_matches, books_by_ids
+# Pipeline orchestrator (project root main.py)
+from main import run_pipeline
 
 def get_db():
     db = SessionLocal()
@@ -54,19 +69,106 @@ class BookResponse(BookBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+class OrjsonResponse(JSONResponse):
+    """JSON response rendered by orjson (UTF-8 bytes straight from C)."""
+    def render(self, content):
+        return orjson.dumps(content)
+
+# --- Response cache ---
+# Short-lived in-process LRU cache for the read endpoints, cleared after each sync (in any worker)
+LIST_CACHE_TTL = 60
+ISBN_CACHE_TTL = 3600
+COUNT_CACHE_TTL = 300
+RESPONSE_CACHE_MAX_ENTRIES = 256
+# Largest page the list/search endpoints serve (and cache); larger limits are clamped to it
+MAX_PAGE_SIZE = 100
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+def cached(key, ttl, compute):
+    """Returns the cached value for key, or computes and stores it for ttl seconds."""
+    clear_cache_after_sync()
+    now = time.monotonic()
+    with _response_cache_lock:
+        hit = _response_cache.get(key)
+        if hit is not None:
+            if hit[0] > now:
+                _response_cache.move_to_end(key)
+                return hit[1]
+            del _response_cache[key]    # expired
+    value = compute()
+    with _response_cache_lock:
+        _response_cache[key] = (now + ttl, value)
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+            _response_cache.popitem(last=False)
+    return value
+
+def etag_matches(if_none_match, etag):
+    """
+    Weak comparison (RFC 9110) of an If-None-Match header against our ETag:
+    '*' matches anything; otherwise any listed tag equal to it, ignoring W/ prefixes.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+def conditional_response(request, body, headers=None, max_age=LIST_CACHE_TTL):
+    """
+    Sends a rendered JSON body with an ETag derived from it and a Cache-Control
+    max-age matching the server-side cache. Returns 304 Not Modified when the
+    client's If-None-Match already matches, skipping the payload.
+    The ETag is weak: GZipMiddleware may send the same body gzip-encoded or plain.
+    """
+    etag = 'W/"{}"'.format(hashlib.blake2b(body, digest_size=8).hexdigest())
+    caching = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=caching)
+    return Response(body, media_type="application/json", headers={**(headers or {}), **caching})
+
+def to_responses(rows):
+    """
+    Plain dicts from Core result mappings; trusted DB rows are not re-validated.
+    BookResponse only documents the shape in the OpenAPI schema.
+    """
+    return [dict(row) for row in rows]
+
+# Plain column select, without ORM identity-map bookkeeping
+BOOK_COLUMNS = select(*Book.__table__.c)
+
+def json_page(page):
+    """
+    Wraps a book select so SQLite itself renders the rows as a JSON array.
+    Returns (JSON text, row count, last id).
+    """
+    page = page.subquery()
+    row = func.json_object(*[arg for c in page.c for arg in (literal(c.name), c)])
+    return select(func.json_group_array(row), func.count(), func.max(page.c.id))
+
 # --- API ---
-# Initialize DB (creates tables if they don't exist)
-Base.metadata.create_all(bind=engine)
+# Set once per worker at startup
+embedding_manager = None
 
-app = FastAPI(title="Book Finder API")
+@asynccontextmanager
+async def lifespan(app):
+    global embedding_manager
+    # Initialize DB (creates tables if they don't exist)
+    init_db()
 
-# Initialize Embedding Manager (Eagerly load to avoid first-hit timeouts)
-try:
-    print("Initializing EmbeddingManager...")
-    embedding_manager = EmbeddingManager()
-except Exception as e:
-    print(f"Warning: Could not initialize EmbeddingManager: {e}")
-    embedding_manager = None
+    # Initialize Embedding Manager (Eagerly load to avoid first-hit timeouts)
+    try:
+        print("Initializing EmbeddingManager...")
+        embedding_manager = EmbeddingManager()
+    except Exception as e:
+        print(f"Warning: Could not initialize EmbeddingManager: {e}")
+        embedding_manager = None
+    yield
+    pipeline_executor.shutdown(wait=False)
+
+app = FastAPI(title="Book Finder API", default_response_class=OrjsonResponse, lifespan=lifespan)
 
 # CORS Configuration
 app.add_middleware(
@@ -77,6 +179,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress JSON pages (descriptions compress well); tiny responses are sent as is
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 @app.get("/health")
 def health_check():
     """Check if the API and search engine are ready."""
@@ -85,131 +190,256 @@ def health_check():
     return {"status": "healthy", "model": "loaded"}
 
 @app.get("/books/", response_model=List[BookResponse])
-def read_books(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_books(
+    request: Request,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1),
+    after_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
     """
-    Retrieve a list of books with pagination.
+    Retrieve a list of books with pagination, ordered by id.
+    Pass the X-Next-Cursor header of a page as after_id to fetch the next one
+    (seeks on the primary key instead of skipping rows like skip/OFFSET).
+    X-Total-Count carries the (cached) number of books.
     """
-    books = db.query(Book).offset(skip).limit(limit).all()
-    return books
+    limit = min(limit, MAX_PAGE_SIZE)
+    stmt = BOOK_COLUMNS.order_by(Book.id).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(Book.id > after_id)
+    else:
+        stmt = stmt.offset(skip)
+
+    body, count, last_id = cached(
+        ("books", skip, limit, after_id), LIST_CACHE_TTL,
+        lambda: db.execute(json_page(stmt)).one()
+    )
+    total = cached(("count",), COUNT_CACHE_TTL, lambda: db.execute(select(func.count()).select_from(Book)).scalar())
+    headers = {"X-Total-Count": str(total)}
+    if count and count == limit:
+        headers["X-Next-Cursor"] = str(last_id)
+    return conditional_response(request, body.encode(), headers)
 
 @app.get("/books/{isbn}", response_model=BookResponse)
-def read_book_by_isbn(isbn: str, db: Session = Depends(get_db)):
+def read_book_by_isbn(isbn: str, request: Request, db: Session = Depends(get_db)):
     """
     Retrieve a specific book by ISBN (13 or 10).
     """
-    book = db.query(Book).filter(
-        or_(Book.isbn_13 == isbn, Book.isbn_10 == isbn)
-    ).first()
-    
-    if book is None:
-        raise HTTPException(status_code=404, detail="Book not found")
-    return book
+    def lookup():
+        # Two index seeks; SQLite would use only one index for an OR
+        book = db.execute(
+            union_all(
+                BOOK_COLUMNS.where(Book.isbn_13 == isbn),
+                BOOK_COLUMNS.where(Book.isbn_10 == isbn)
+            ).limit(1)
+        ).mappings().first()
+        
+        if book is None:
+            raise HTTPException(status_code=404, detail="Book not found")
+        return dict(book)
+
+    return conditional_response(
+        request, orjson.dumps(cached(("isbn", isbn), ISBN_CACHE_TTL, lookup)), max_age=ISBN_CACHE_TTL
+    )
 
 @app.get("/search/", response_model=List[BookResponse])
-def search_books(q: str = Query(..., min_length=3), db: Session = Depends(get_db)):
+def search_books(
+    request: Request,
+    q: str = Query(..., min_length=3),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1),
+    db: Session = Depends(get_db)
+):
     """
-    Search books by title or author.
+    Search books by title, subtitle or author (full-text, substring matching), or exact ISBN-13.
+    Pages with skip/limit (at most MAX_PAGE_SIZE books); X-Total-Count carries the number of matches.
     """
-    search_term = f"%{q}%"
-    books = db.query(Book).filter(
-        or_(
-            Book.title.ilike(search_term),
-            Book.authors.ilike(search_term),
-            Book.isbn_13 == q
-        )
-    ).all()
-    return books
+    limit = min(limit, MAX_PAGE_SIZE)
+    books = cached(
+        ("search", q, skip, limit), LIST_CACHE_TTL,
+        lambda: to_responses(keyword_search(db, q, limit, skip))
+    )
+    total = cached(("search-count", q), LIST_CACHE_TTL, lambda: count_keyword_matches(db, q))
+    return conditional_response(request, orjson.dumps(books), {"X-Total-Count": str(total)})
+
+# ChromaDB candidates considered per semantic query, before the threshold cut
+SEMANTIC_POOL_SIZE = 300
+
+def semantic_search_ids(q, threshold):
+    """Book primary keys for a semantic query within the threshold, most relevant first."""
+    # Search ChromaDB with a larger pool; book primary keys are stored in the Chroma
+    # metadata (lower distance = higher similarity)
+    return cached(
+        ("semantic-ids", q, threshold), LIST_CACHE_TTL,
+        lambda: embedding_manager.search_book_ids(q, n_results=SEMANTIC_POOL_SIZE, max_distance=threshold)
+    )
 
 @app.get("/semantic-search/", response_model=List[BookResponse])
 def semantic_search_books(
+    request: Request,
     q: str = Query(..., min_length=3), 
-    limit: int = 100,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1),
     threshold: float = 0.7,
     db: Session = Depends(get_db)
 ):
     """
     Search books based on semantic meaning using vector embeddings.
     Matches the logic used in the Streamlit application.
+    Pages with skip/limit (at most MAX_PAGE_SIZE books); X-Total-Count carries the number of matches.
     """
+    limit = min(limit, MAX_PAGE_SIZE)
     if not embedding_manager:
         raise HTTPException(status_code=503, detail="Semantic search engine is not initialized (check model download).")
     
     try:
-        # 1. Search in ChromaDB with a larger pool for filtering
-        search_results = embedding_manager.search(q, n_results=300)
-        
-        # 2. Extract identifiers and distances
-        ids = search_results.get("ids", [[]])[0]
-        distances = search_results.get("distances", [[]])[0]
-        
-        if not ids:
-            return []
-            
-        # 3. Filter by threshold (lower distance = higher similarity)
-        filtered_ids_with_dist = [
-            (idx, dist) for idx, dist in zip(ids, distances) if dist <= threshold
-        ]
-        
-        if not filtered_ids_with_dist:
-            return []
-            
-        # Keep only the top 'limit' identifiers
-        top_ids = [idx for idx, dist in filtered_ids_with_dist[:limit]]
-            
-        # 4. Retrieve full book records from SQLite
-        books = db.query(Book).filter(
-            or_(
-                Book.isbn_13.in_(top_ids),
-                Book.google_id.in_(top_ids)
-            )
-        ).all()
-        
-        # 5. Sort results based on the order returned from ChromaDB (relevance)
-        id_to_index = {idx: i for i, idx in enumerate(top_ids)}
-        books.sort(key=lambda b: id_to_index.get(b.isbn_13) if b.isbn_13 in id_to_index else id_to_index.get(b.google_id, 999))
-        
-        return books
+        book_ids = semantic_search_ids(q, threshold)
+        # Only the requested page is read from SQLite, in ChromaDB (relevance) order
+        books = cached(
+            ("semantic", q, threshold, skip, limit), LIST_CACHE_TTL,
+            lambda: to_responses(books_by_ids(db, book_ids[skip:skip + limit]))
+        )
+        return conditional_response(request, orjson.dumps(books), {"X-Total-Count": str(len(book_ids))})
         
     except Exception as e:
         print(f"Error during semantic search: {e}")
         raise HTTPException(status_code=500, detail=f"Internal Search Error: {str(e)}")
 
-@app.get("/sync/")
-def sync_data():
+# Guards against concurrent pipeline runs in this process
+sync_lock = threading.Lock()
+# The pipeline gets its own thread, so a long run never occupies the request threadpool
+pipeline_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline")
+
+# Sentinel file locked while a pipeline runs, shared by all worker processes
+SYNC_LOCK_FILE = "data/sync.lock"
+# Progress of the latest run, reported by /sync/status on every worker
+SYNC_STATE_FILE = "data/sync_state.json"
+IDLE_SYNC_STATE = {"status": "idle", "started_at": None, "finished_at": None}
+
+def acquire_sync_file_lock():
     """
-    Trigger the main data synchronization pipeline.
-    This runs main.py in the background.
+    Takes an exclusive, non-blocking flock on SYNC_LOCK_FILE. Returns the open file
+    (closing it releases the lock), or None if another process is running the pipeline.
     """
-    import subprocess
-    import threading
-    import sys
-    
-    # Global lock to prevent concurrent syncs
-    sync_lock = threading.Lock()
-    
-    def run_pipeline():
-        if not sync_lock.acquire(blocking=False):
-            print("Pipeline already running. Skipping trigger.")
+    os.makedirs(os.path.dirname(SYNC_LOCK_FILE), exist_ok=True)
+    lock_file = open(SYNC_LOCK_FILE, "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+    return lock_file
+
+def process_alive(pid):
+    """Signal 0 only checks that the pid exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def pipeline_running(state=None):
+    """
+    True if this or any other worker process is running the pipeline, judged from the
+    shared state file and the pid that wrote it. The flock itself is only ever taken by
+    run_sync, so checking never gets in the way of a run that is about to start.
+    """
+    if sync_lock.locked():
+        return True
+    state = state or read_sync_state()
+    return state["status"] == "running" and bool(state.get("pid")) and process_alive(state["pid"])
+
+def write_sync_state(**state):
+    """Replaces SYNC_STATE_FILE atomically, so readers never see a partial file."""
+    tmp_path = f"{SYNC_STATE_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(state))
+    os.replace(tmp_path, SYNC_STATE_FILE)
+
+def read_sync_state():
+    try:
+        with open(SYNC_STATE_FILE, "rb") as f:
+            return orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return dict(IDLE_SYNC_STATE)
+
+def sync_state_version():
+    try:
+        return os.stat(SYNC_STATE_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+# Every worker drops its response cache when the shared sync state changes (a run started
+# or finished in any process); checked with one stat() per cache lookup
+_seen_sync_version = sync_state_version()
+
+def clear_cache_after_sync():
+    global _seen_sync_version
+    version = sync_state_version()
+    if version != _seen_sync_version:
+        with _response_cache_lock:
+            _response_cache.clear()
+        _seen_sync_version = version
+
+def run_sync():
+    if not sync_lock.acquire(blocking=False):
+        print("Pipeline already running. Skipping trigger.")
+        return
+    try:
+        lock_file = acquire_sync_file_lock()
+        if lock_file is None:
+            print("Pipeline already running in another worker. Skipping trigger.")
             return
         try:
-            # Using sys.executable to ensure the same interpreter is used
-            subprocess.run([sys.executable, "main.py"], cwd=os.getcwd())
+            started_at = time.time()
+            write_sync_state(status="running", started_at=started_at, finished_at=None, pid=os.getpid())
+            ok = False
+            try:
+                ok = run_pipeline()
+            finally:
+                write_sync_state(
+                    status="succeeded" if ok else "failed", started_at=started_at, finished_at=time.time()
+                )
         finally:
-            sync_lock.release()
-        
-    thread = threading.Thread(target=run_pipeline)
-    thread.start()
+            lock_file.close()
+    finally:
+        sync_lock.release()
+
+@app.get("/sync/")
+def sync_data():
+    """
+    Trigger the main data synchronization pipeline.
+    The pipeline runs in the background on a dedicated thread; poll /sync/status for progress.
+    """
+    if pipeline_running():
+        return {"status": "running", "message": "Pipeline already running; poll /sync/status"}
+    pipeline_executor.submit(run_sync)
     
     return {"status": "success", "message": "Pipeline triggered in background"}
 
+@app.get("/sync/status")
+def sync_status():
+    """State of the latest pipeline run: idle, running, succeeded or failed."""
+    state = read_sync_state()
+    if state["status"] == "running" and not pipeline_running(state):
+        # The process running it died without recording the outcome
+        state["status"] = "failed"
+    state.pop("pid", None)
+    return state
+
 if __name__ == "__main__":
     import uvicorn
     parser = argparse.ArgumentParser(description="Run Book Finder API")
     parser.add_argument("--host", default="127.0.0.1", help="Host to bind to")
     parser.add_argument("--port", type=int, default=8000, help="Port to bind to")
     parser.add_argument("--reload", action="store_true", help="Enable auto-reload")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (each loads its own model)")
     
     args = parser.parse_args()
     
     # Use 127.0.0.1 for local dev to avoid some binding issues
-    uvicorn.run("serving:app", host=args.host, port=args.port, reload=args.reload)
+    # uvloop/httptools (from uvicorn[standard]) are picked up automatically
+    uvicorn.run("serving:app", host=args.host, port=args.port, reload=args.reload, workers=args.workers)
@@ -1,8 +1,14 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import sys
 import html
+from collections import deque
+from functools import cached_property
+from itertools import islice
+from jinja2 import Environment
 from sqlalchemy.orm import Session
 
 # Version stamp for deployment verification
@@ -15,7 +21,6 @@ API_URL = os.environ.get("API_URL")
 
 # Conditional imports to allow running without local DB/ML deps
 try:
-    from sqlalchemy import or_
     from storage import db
     from ml.embeddings import EmbeddingManager
     HAS_LOCAL_DEPS = True
@@ -27,6 +32,11 @@ class BookWrapper:
     def __init__(self, data):
         self.__dict__.update(data)
 
+    @cached_property
+    def card_html(self):
+        # Cached search results are reused across reruns, so each card is rendered once
+        return render_card(self)
+
 # --- Configuration & Styling ---
 st.set_page_config(
     page_title="Book Finder | Semantic Search",
@@ -296,7 +306,43 @@ st.markdown(f"""
 # --- Logic ---
 
 PAGE_SIZE = 15
+DESCRIPTION_PREVIEW_LENGTH = 250
+NO_COVER_URL = "https://via.placeholder.com/120x180?text=No+Cover"
+
+# Result card, compiled once; autoescape escapes every field
+CARD_TEMPLATE = Environment(autoescape=True).from_string(
+    '<div class="book-card">'
+    '<img src="{{ book.thumbnail or no_cover }}" class="book-thumbnail" onerror="this.src=\'{{ no_cover }}\'">'
+    '<div class="book-info">'
+    '<div class="book-title">{{ book.title or "Untitled" }}</div>'
+    '{% if book.subtitle %}<div class="book-subtitle">{{ book.subtitle }}</div>{% endif %}'
+    '<div class="book-author">by {{ book.authors or "Unknown Author" }}</div>'
+    '<div class="book-description">{{ description }}</div>'
+    '<div class="category-tag">{{ category }}</div>'
+    '</div></div>'
+)
+
+def render_card(book):
+    """Result card HTML with a truncated description and the first category."""
+    if not book.description:
+        description_short = "No description available."
+    elif len(book.description) > DESCRIPTION_PREVIEW_LENGTH:
+        description_short = book.description[:DESCRIPTION_PREVIEW_LENGTH] + "..."
+    else:
+        description_short = book.description
+    category = book.categories.split(",")[0] if book.categories else "General"
+    return CARD_TEMPLATE.render(
+        book=book, description=description_short, category=category, no_cover=NO_COVER_URL
+    )
+
 DISTANCE_THRESHOLD = 0.7  # Lower distance means higher similarity
+# Search results are reused across reruns/page clicks, but expire so new syncs show up.
+# They are cached as shared objects (cache_resource): the UI only reads them, so the
+# per-hit pickle/unpickle copy of cache_data is skipped
+SEARCH_CACHE_TTL = 300
+SEARCH_CACHE_MAX_ENTRIES = 256
+# Sidebar health status is re-checked at most this often instead of on every rerun
+HEALTH_CACHE_TTL = 30
 
 @st.cache_resource(show_spinner=False)
 def get_embedding_manager():
@@ -304,29 +350,40 @@ def get_embedding_manager():
         return None
     return EmbeddingManager()
 
-@st.cache_data(show_spinner=False)
-def _get_db_session():
-    if API_URL:
-        return None
-    return db.SessionLocal()
+@st.cache_resource(show_spinner=False)
+def get_api_session():
+    """Shared HTTP session for API calls; keeps connections to the API alive across reruns."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504], raise_on_status=False)
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
 def get_db():
     if API_URL:
         return None
-    return db.SessionLocal()
+    return db.ScopedSession()
 
-def get_api_health():
+def check_api_health(session):
     """Check if the backend is actually ready"""
-    if not API_URL:
-        return {"status": "local", "message": "Running in Local Mode"}
     try:
-        response = requests.get(f"{API_URL}/health", timeout=5)
+        response = session.get(f"{API_URL}/health", timeout=5)
         if response.status_code == 200:
             return response.json()
         return {"status": "error", "message": f"HTTP {response.status_code}"}
     except Exception:
         return {"status": "offline", "message": "API is waking up..."}
 
+@st.cache_data(show_spinner=False, ttl=HEALTH_CACHE_TTL)
+def get_api_health():
+    if not API_URL:
+        return {"status": "local", "message": "Running in Local Mode"}
+    return check_api_health(get_api_session())
+
 @st.dialog("Book Details", width="large")
 def show_book_details(book):
     title = html.escape(book.title) if book.title else "Untitled"
@@ -351,70 +408,67 @@ def show_book_details(book):
         st.markdown("#### Description")
         st.write(description)
 
-@st.cache_data(show_spinner=False)
-def perform_semantic_search_cached(query, n_results=300, threshold=DISTANCE_THRESHOLD):
+@st.cache_resource(show_spinner=False, ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES)
+def perform_semantic_search_cached(query, page=1, n_results=300, threshold=DISTANCE_THRESHOLD):
+    """Fetches one page of semantic results and the total number of matches."""
+    offset = (page - 1) * PAGE_SIZE
     if API_URL:
         try:
             # Increase timeout to 120s to handle cold starts and high load on Render Free tier
-            response = requests.get(f"{API_URL}/semantic-search/", params={"q": query}, timeout=120)
+            response = get_api_session().get(
+                f"{API_URL}/semantic-search/",
+                params={"q": query, "skip": offset, "limit": PAGE_SIZE, "threshold": threshold},
+                timeout=120
+            )
             if response.status_code == 200:
                 books_data = response.json()
-                return [BookWrapper(b) for b in books_data]
+                results = [BookWrapper(b) for b in books_data]
+                total = int(response.headers.get("X-Total-Count", offset + len(results)))
+                return results, total
             else:
                 st.error(f"API Error: {response.status_code}. The server might still be initializing.")
-                return []
+                return [], 0
         except Exception as e:
             st.error(f"API Connection Issue: {e}. Please wait a moment and try again.")
-            return []
+            return [], 0
 
     if not HAS_LOCAL_DEPS:
         st.error("Local dependencies not found and API_URL not set.")
-        return []
+        return [], 0
 
     manager = get_embedding_manager()
-    session = get_db()
     
-    results = manager.search(query, n_results=n_results)
-    ids = results.get("ids", [[]])[0]
-    distances = results.get("distances", [[]])[0]
+    # Chroma metadata carries the SQLite primary key
+    filtered_ids = manager.search_book_ids(query, n_results=n_results, max_distance=threshold)
+    page_ids = filtered_ids[offset:offset + PAGE_SIZE]
     
-    if not ids:
-        session.close()
-        return []
-        
-    # Filter by threshold
-    filtered_ids = [idx for idx, dist in zip(ids, distances) if dist <= threshold]
+    if not page_ids:
+        return [], len(filtered_ids)
     
-    if not filtered_ids:
+    # Primary-key lookup of the current page only, already sorted by relevance (Chromadb order) in SQL
+    session = get_db()
+    try:
+        return [BookWrapper(row) for row in db.books_by_ids(session, page_ids)], len(filtered_ids)
+    finally:
         session.close()
-        return []
-        
-    books = session.query(db.Book).filter(
-        or_(
-            db.Book.isbn_13.in_(filtered_ids),
-            db.Book.google_id.in_(filtered_ids)
-        )
-    ).all()
-    
-    # Sort by relevance (Chromadb order)
-    id_to_index = {idx: i for i, idx in enumerate(filtered_ids)}
-    books.sort(key=lambda b: id_to_index.get(b.isbn_13) if b.isbn_13 in id_to_index else id_to_index.get(b.google_id, 999))
-    
-    # Detach from session to allow serializing for cache
-    session.expunge_all()
-    session.close()
-    return books
 
-@st.cache_data(show_spinner=False)
-def perform_keyword_search_cached(query):
+@st.cache_resource(show_spinner=False, ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES)
+def perform_keyword_search_cached(query, page=1):
+    """Fetches one page of keyword results and the total number of matches."""
+    offset = (page - 1) * PAGE_SIZE
     if API_URL:
         try:
             # Increase timeout to 30s to handle initial API connection
-            response = requests.get(f"{API_URL}/search/", params={"q": query}, timeout=30)
+            response = get_api_session().get(
+                f"{API_URL}/search/",
+                params={"q": query, "skip": offset, "limit": PAGE_SIZE},
+                timeout=30
+            )
             if response.status_code == 200:
                 books_data = response.json()
                 results = [BookWrapper(b) for b in books_data]
-                return results, len(results)
+                total = int(response.headers.get("X-Total-Count", offset + len(results)))
+                return results, total
             else:
                 st.error(f"API Error: {response.status_code}")
                 return [], 0
@@ -427,32 +481,23 @@ def perform_keyword_search_cached(query):
         return [], 0
 
     session = get_db()
-    search_term = f"%{query}%"
-    query_obj = session.query(db.Book).filter(
-        or_(
-            db.Book.title.ilike(search_term),
-            db.Book.authors.ilike(search_term),
-            db.Book.isbn_13 == query
-        )
-    )
-    results = query_obj.all()
-    total = len(results)
-    
-    # Detach from session
-    session.expunge_all()
-    session.close()
+    try:
+        results = [BookWrapper(row) for row in db.keyword_search(session, query, PAGE_SIZE, offset)]
+        total = db.count_keyword_matches(session, query)
+    finally:
+        session.close()
     return results, total
 
-def perform_semantic_search(query, manager, session, n_results=300, threshold=DISTANCE_THRESHOLD):
+def perform_semantic_search(query, manager, session, page=1, n_results=300, threshold=DISTANCE_THRESHOLD):
     # Keep original for internal calls if needed, but UI uses cached version
-    return perform_semantic_search_cached(query, n_results, threshold)
+    return perform_semantic_search_cached(query, page, n_results, threshold)
 
-def perform_keyword_search(query, session):
-    return perform_keyword_search_cached(query)
+def perform_keyword_search(query, session, page=1):
+    return perform_keyword_search_cached(query, page)
 
 # --- Session State ---
 if 'history' not in st.session_state:
-    st.session_state.history = []
+    st.session_state.history = deque(maxlen=10)  # oldest query drops off automatically
 if 'page' not in st.session_state:
     st.session_state.page = 1
 if 'total_results' not in st.session_state:
@@ -462,6 +507,20 @@ if 'current_results' not in st.session_state:
 if 'last_final_query' not in st.session_state:
     st.session_state.last_final_query = ""
 
+# --- Callbacks ---
+# Widgets update session state in on_click/on_change callbacks, which run before the
+# rerun they trigger; calling st.rerun() after the widget would run the script twice
+
+def use_history_query(h_query):
+    st.session_state.active_query = h_query
+    st.session_state.page = 1  # Reset to page 1 on new search
+
+def change_page(step):
+    st.session_state.page += step
+
+def change_theme():
+    st.session_state.theme_choice = st.session_state.theme_select
+
 # --- UI ---
 
 st.markdown('<div class="main-header">Book Finder</div>', unsafe_allow_html=True)
@@ -473,14 +532,13 @@ with st.sidebar:
     
     st.divider()
     st.markdown("### Appearance")
-    theme_choice = st.selectbox(
+    st.selectbox(
         "Theme",
         options=list(themes.keys()),
-        index=list(themes.keys()).index(st.session_state.theme_choice)
+        index=list(themes.keys()).index(st.session_state.theme_choice),
+        key="theme_select",
+        on_change=change_theme
     )
-    if theme_choice != st.session_state.theme_choice:
-        st.session_state.theme_choice = theme_choice
-        st.rerun()
 
     st.divider()
     st.markdown("### Search Settings")
@@ -518,20 +576,17 @@ query_input = st.text_input(
     help="Type your query and press Enter. Click history chips below to reuse previous searches."
 )
 
-if "history" not in st.session_state:
-    st.session_state.history = []
-
 with st.sidebar:
-    # History chips
+    # History chips, most recent first
     if st.session_state.history:
         st.divider()
         st.markdown("##### Recent Searches")
-        hist_cols = st.columns(min(len(st.session_state.history), 5))
-        for i, h_query in enumerate(reversed(st.session_state.history[-5:])):
-            if hist_cols[i].button(h_query, key=f"hist_chip_{i}", width="stretch"):
-                st.session_state.active_query = h_query
-                st.session_state.page = 1  # Reset to page 1 on new search
-                st.rerun()
+        recent = list(islice(reversed(st.session_state.history), 5))
+        hist_cols = st.columns(len(recent))
+        for i, h_query in enumerate(recent):
+            hist_cols[i].button(
+                h_query, key=f"hist_chip_{i}", width="stretch", on_click=use_history_query, args=(h_query,)
+            )
 
 final_query = st.session_state.get('active_query', query_input)
 
@@ -546,28 +601,17 @@ if final_query:
         
     if final_query and final_query not in st.session_state.history:
         st.session_state.history.append(final_query)
-        if len(st.session_state.history) > 10:
-            st.session_state.history.pop(0)
     
     # Only perform search if it's a new query OR page reset
     # (Actually, in Streamlit, it usually re-renders. We can optimize but let's keep it simple first)
     with st.spinner("Finding the best matches..."):
-        # For Semantic Search, we fetch a large pool and paginate locally
-        # For Keyword Search, we fetch all and paginate locally (given the DB is small enough)
-        # In a real app, we'd use offset/limit on the DB.
-        if "active_query_results" not in st.session_state or st.session_state.last_final_query != final_query or st.session_state.get('last_search_mode') != search_mode:
-            if "Semantic" in search_mode:
-                results = perform_semantic_search_cached(final_query)
-                total = len(results)
-            else:
-                results, total = perform_keyword_search_cached(final_query)
-            
-            st.session_state.active_query_results = results
-            st.session_state.total_results = total
-            st.session_state.last_search_mode = search_mode
-    
-    results = st.session_state.active_query_results
-    total = st.session_state.total_results
+        # Both modes fetch only the current page (offset/limit) plus the total match count
+        if "Semantic" in search_mode:
+            results, total = perform_semantic_search_cached(final_query, st.session_state.page)
+        else:
+            results, total = perform_keyword_search_cached(final_query, st.session_state.page)
+        st.session_state.total_results = total
+        st.session_state.last_search_mode = search_mode
     
     if not results:
         st.warning("No books found matching your query.")
@@ -575,32 +619,13 @@ if final_query:
         # Paging math
         start_idx = (st.session_state.page - 1) * PAGE_SIZE
         end_idx = min(start_idx + PAGE_SIZE, total)
-        page_results = results[start_idx:end_idx]
         
         st.markdown(f'<div class="search-info">Showing {start_idx + 1} to {end_idx} of {total} results for \'{final_query}\'</div>', unsafe_allow_html=True)
         
-        for i, book in enumerate(page_results):
-            title = html.escape(book.title) if book.title else "Untitled"
-            subtitle = html.escape(book.subtitle) if book.subtitle else ""
-            authors = html.escape(book.authors) if book.authors else "Unknown Author"
-            description_short = html.escape(book.description[:250] + "...") if book.description and len(book.description) > 250 else html.escape(book.description) if book.description else "No description available."
-            thumbnail = book.thumbnail if book.thumbnail else "https://via.placeholder.com/120x180?text=No+Cover"
-            categories = html.escape(book.categories.split(",")[0]) if book.categories else "General"
-            
+        for i, book in enumerate(results):
             card_col1, card_col2 = st.columns([5, 1])
             with card_col1:
-                book_html = (
-                    f'<div class="book-card">'
-                    f'<img src="{thumbnail}" class="book-thumbnail" onerror="this.src=\'https://via.placeholder.com/120x180?text=No+Cover\'">'
-                    f'<div class="book-info">'
-                    f'<div class="book-title">{title}</div>'
-                    f'{"<div class=\'book-subtitle\'>" + subtitle + "</div>" if subtitle else ""}'
-                    f'<div class="book-author">by {authors}</div>'
-                    f'<div class="book-description">{description_short}</div>'
-                    f'<div class="category-tag">{categories}</div>'
-                    f'</div></div>'
-                )
-                st.markdown(book_html, unsafe_allow_html=True)
+                st.markdown(book.card_html, unsafe_allow_html=True)
             with card_col2:
                 st.write("") # Spacer
                 st.write("") # Spacer
@@ -612,17 +637,13 @@ if final_query:
         col_prev, col_mid, col_next = st.columns([1, 2, 1])
         with col_prev:
             if st.session_state.page > 1:
-                if st.button("← Previous Page", width="stretch"):
-                    st.session_state.page -= 1
-                    st.rerun()
+                st.button("← Previous Page", width="stretch", on_click=change_page, args=(-1,))
         with col_mid:
             num_pages = (total + PAGE_SIZE - 1) // PAGE_SIZE
             st.markdown(f"<p style='text-align: center;'>Page <b>{st.session_state.page}</b> of {num_pages}</p>", unsafe_allow_html=True)
         with col_next:
             if end_idx < total:
-                if st.button("Next Page →", width="stretch"):
-                    st.session_state.page += 1
-                    st.rerun()
+                st.button("Next Page →", width="stretch", on_click=change_page, args=(1,))
 else:
     st.write("---")
     st.markdown("""
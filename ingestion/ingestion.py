@@ -1,25 +1,78 @@
 import pandas as pd
 import aiohttp
 import asyncio
-import json
 import argparse
 import os
+import orjson
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from typing import Optional, Dict, Any, Set, List
 
 # Configuration
 MAX_CONCURRENT_REQUESTS = 3
+REQUESTS_PER_SECOND = 4    # shared by all workers
 SAVE_INTERVAL = 20
+QUEUE_SIZE = 200
+REORDER_WINDOW = 2 * QUEUE_SIZE    # rows fed past the oldest one not yet written
+INPUT_COLUMNS = ("Acc. No.", "Title", "Author/Editor")
+WRITE_BUFFER_SIZE = 1 << 20
 GOOGLE_VOLUME_API = "https://www.googleapis.com/books/v1/volumes/{}"
+RETRY_STATUSES = {429, 500, 502, 503}    # throttled or transient server errors
+MAX_BACKOFF = 60
+MIN_TITLE_LENGTH = 2
+# Partial response: only the volume fields kept in the output record are sent back
+GOOGLE_RESPONSE_FIELDS = (
+    "items(id,volumeInfo(title,subtitle,authors,description,publishedDate,pageCount,"
+    "categories,averageRating,imageLinks/thumbnail,previewLink,industryIdentifiers))"
+)
+DNS_CACHE_TTL = 600
+KEEPALIVE_TIMEOUT = 75
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=5)
 
-def clean_text(text):    # helper function to normalize text fields (titles, authors) before sending them to the API.
-    if not isinstance(text, str):
-        return ""
-    text = " ".join(text.split())    #collapses multiple spaces into one and removes hidden newlines.
-    text = text.strip(".,/:;")    #removes common punctuation.
-    return text
+def get_retry_after(response, default: float) -> float:
+    """Returns the server's Retry-After delay (seconds or HTTP-date), or the default backoff."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return default
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return default
+    return min(max(delay, 0), MAX_BACKOFF)
+
+class RateLimiter:
+    """Token bucket shared by all workers: at most `rate` requests per second, bursts up to `burst`."""
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()    # waiters are served in arrival order
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)    # until the next token is due
+
+def clean_column(col):    # helper function to normalize text columns (titles, authors) before sending them to the API.
+    col = col.fillna("").astype(str)
+    col = col.str.split().str.join(" ")    #collapses multiple spaces into one and removes hidden newlines.
+    return col.str.strip(".,/:;")    #removes common punctuation.
 
 # search Google Books API for a book by title and author
-async def search_google_books(session: aiohttp.ClientSession, title: str, author: str, retries=0) -> Optional[Dict[str, Any]]:  
+async def search_google_books(session: aiohttp.ClientSession, title: str, author: str, retries=0, limiter: Optional[RateLimiter] = None) -> Optional[Dict[str, Any]]:  
     base_url = "https://www.googleapis.com/books/v1/volumes"
     query = f"intitle:{title}"    # search for the book by title
     if author:
@@ -28,7 +81,9 @@ async def search_google_books(session: aiohttp.ClientSession, title: str, author
     params = {
         "q": query, # search query
         "maxResults": 1, # maximum number of results to return
-        "langRestrict": "en" # restrict results to English
+        "langRestrict": "en", # restrict results to English
+        "printType": "books", # skip magazines server-side
+        "fields": GOOGLE_RESPONSE_FIELDS # trim the response to what we store
     }
     
     backoff = 2 ** retries    # exponential backoff
@@ -36,39 +91,46 @@ async def search_google_books(session: aiohttp.ClientSession, title: str, author
         # print(f"Max retries reached for {title}")
         return None
 
+    wait_time = None
     try:
+        if limiter:
+            await limiter.acquire()    # every attempt, retries included, takes a token
         async with session.get(base_url, params=params) as response: 
-            if response.status == 429:    # if too many requests
-                wait_time = min(backoff * 1.5, 60)    
+            if response.status in RETRY_STATUSES:    # if too many requests or a transient server error
+                wait_time = get_retry_after(response, min(backoff * 1.5, MAX_BACKOFF))
                 # print(f"Rate limited. Waiting {wait_time}s... (Retry {retries+1})") 
-                await asyncio.sleep(wait_time)    # wait for the backoff period
-                return await search_google_books(session, title, author, retries+1)    # retry the request
-            
-            response.raise_for_status()    # raise an exception if the request was not successful
-            data = await response.json()
+            else:
+                response.raise_for_status()    # raise an exception if the request was not successful
+                data = orjson.loads(await response.read())
             
-            if "items" in data and len(data["items"]) > 0:  
-                item = data["items"][0]
-                volume_info = item.get("volumeInfo", {})
+                if "items" in data and len(data["items"]) > 0:  
+                    item = data["items"][0]
+                    volume_info = item.get("volumeInfo", {})
                 
-                return {
-                    "google_id": item.get("id"),
-                    "title": volume_info.get("title"),
-                    "subtitle": volume_info.get("subtitle"),
-                    "authors": volume_info.get("authors", []),
-                    "description": volume_info.get("description"),
-                    "published_date": volume_info.get("publishedDate"),
-                    "page_count": volume_info.get("pageCount"),
-                    "categories": volume_info.get("categories", []),
-                    "average_rating": volume_info.get("averageRating"),
-                    "thumbnail": volume_info.get("imageLinks", {}).get("thumbnail"),
-                    "preview_link": volume_info.get("previewLink"),
-                    "industry_identifiers": volume_info.get("industryIdentifiers", [])
-                }
+                    return {
+                        "google_id": item.get("id"),
+                        "title": volume_info.get("title"),
+                        "subtitle": volume_info.get("subtitle"),
+                        "authors": volume_info.get("authors", []),
+                        "description": volume_info.get("description"),
+                        "published_date": volume_info.get("publishedDate"),
+                        "page_count": volume_info.get("pageCount"),
+                        "categories": volume_info.get("categories", []),
+                        "average_rating": volume_info.get("averageRating"),
+                        "thumbnail": volume_info.get("imageLinks", {}).get("thumbnail"),
+                        "preview_link": volume_info.get("previewLink"),
+                        "industry_identifiers": volume_info.get("industryIdentifiers", [])
+                    }
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError):    # dropped connection or timeout: retry too
+        wait_time = min(backoff * 1.5, MAX_BACKOFF)
     except Exception: # catch any exceptions that may occur
         pass
     
-    return None
+    if wait_time is None:
+        return None
+    # Sleep after the response is released; jitter spreads out workers throttled at the same moment
+    await asyncio.sleep(min(wait_time + random.uniform(0, wait_time / 2), MAX_BACKOFF))    # wait for the backoff period
+    return await search_google_books(session, title, author, retries+1, limiter)    # retry the request
 
 
 async def fetch_isbns(session, google_id):
@@ -79,7 +141,7 @@ async def fetch_isbns(session, google_id):
     try:
         async with session.get(url) as response:
             if response.status == 200:
-                data = await response.json()
+                data = orjson.loads(await response.read())
                 return data.get("volumeInfo", {}).get("industryIdentifiers", [])
             elif response.status == 429:
                 return "RATE_LIMIT"    
@@ -88,40 +150,84 @@ async def fetch_isbns(session, google_id):
     return []
 
 
-async def process_book(session, row, semaphore):
-    async with semaphore:
-        original_title = clean_text(row.get("Title", ""))
-        original_author = clean_text(row.get("Author/Editor", ""))
-        
-        if not original_title:
-            return None
+@dataclass
+class IngestionState:
+    """Per-run state shared by all fetch workers."""
+    session: aiohttp.ClientSession
+    limiter: Optional[RateLimiter] = None
+    lookups: Dict[tuple, asyncio.Future] = field(default_factory=dict)    # (title, author) -> lookup task
 
-        # 1. Search Google
-        google_data = await search_google_books(session, original_title, original_author)    # await suspends this task until the API responds. Other tasks continue running meanwhile.
-        
-        await asyncio.sleep(0.5)    # pause for 0.5 seconds to avoid overwhelming the API
-        
-        return {
-            "original_id": row.get("Acc. No."),
-            "original_title": original_title,
-            "original_author": original_author,
-            "google_book_data": google_data,
-            "found": google_data is not None
-        }
+async def process_book(state: IngestionState, row):
+    # Title and author were cleaned column-wise in main()
+    original_title = row["Title"]
+    original_author = row["Author/Editor"]
+
+    # 1. Search Google; copies of the same book (title, author) share one lookup, even while it is in flight
+    key = (original_title.casefold(), original_author.casefold())
+    lookup = state.lookups.get(key)
+    if lookup is None:
+        lookup = state.lookups[key] = asyncio.ensure_future(
+            search_google_books(state.session, original_title, original_author, limiter=state.limiter)
+        )
+    google_data = await lookup    # await suspends this task until the API responds. Other tasks continue running meanwhile.
+    
+    return {
+        "original_id": row.get("Acc. No."),
+        "original_title": original_title,
+        "original_author": original_author,
+        "google_book_data": google_data,
+        "found": google_data is not None
+    }
+
+# Marks a worker as finished on the results queue
+WORKER_DONE = object()
+
+async def feed_rows(rows, row_queue, workers, window):
+    for index, row in enumerate(rows):
+        await window.acquire()    # released when the writer writes a row
+        await row_queue.put((index, row))
+    for _ in range(workers):
+        await row_queue.put(None)    # one stop signal per worker
+
+async def fetch_worker(state: IngestionState, row_queue, result_queue):
+    """Processes rows until it receives None; puts exactly one (index, result) on the queue per row."""
+    try:
+        while (item := await row_queue.get()) is not None:
+            index, row = item
+            await result_queue.put((index, await process_book(state, row)))
+    except Exception as e:
+        await result_queue.put(e)    # the writer stops: this row will never arrive
+        raise
+    finally:
+        await result_queue.put(WORKER_DONE)
 
 # This function prevents duplicate processing.
 def load_processed_ids(output_file: str) -> Set[Any]:
     processed_ids = set()
     if os.path.exists(output_file):    # if the file exists
-        with open(output_file, "r", encoding='utf-8') as f:
+        with open(output_file, "rb") as f:    # orjson parses the raw bytes, no decode step
             for line in f:
                 try:
-                    record = json.loads(line)
+                    record = orjson.loads(line)
                     processed_ids.add(str(record["original_id"]))
-                except json.JSONDecodeError:
+                except orjson.JSONDecodeError:
                     pass
     return processed_ids
 
+def positive_int(value):
+    """argparse type for counts that must be at least 1."""
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+def positive_float(value):
+    """argparse type for rates that must be above 0."""
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"must be a positive number, got {value}")
+    return number
+
 async def main():
     parser = argparse.ArgumentParser(description="Ingest books from Google Books API Async")
     parser.add_argument("--limit", type=int, help="Limit number of books to process", default=None)
@@ -129,12 +235,15 @@ async def main():
 
     parser.add_argument("--input", type=str, default="data/raw/Accession Register-Books.csv")
     parser.add_argument("--output", type=str, default="data/processed/books_enriched.jsonl")
+    parser.add_argument("--concurrency", type=positive_int, default=MAX_CONCURRENT_REQUESTS, help="Maximum number of in-flight API requests")
+    parser.add_argument("--rate", type=positive_float, default=REQUESTS_PER_SECOND, help="Maximum API requests per second across all workers")
     # overall:  python ingestion.py --limit 100 --input my_books.csv --output out.jsonl
     args = parser.parse_args()
 
     print(f"Reading from {args.input}...", flush=True)
     try:
-        df = pd.read_csv(args.input)
+        # Only the columns used here, all read as text (no type inference, IDs kept verbatim)
+        df = pd.read_csv(args.input, usecols=lambda c: c in INPUT_COLUMNS, dtype=str, keep_default_na=False)
     except FileNotFoundError:
         print(f"Error: Input file {args.input} not found.")
         return
@@ -142,34 +251,75 @@ async def main():
     processed_ids = load_processed_ids(args.output)
     print(f"Found {len(processed_ids)} already processed records.", flush=True)
 
-    # Filter DF - Ensure string comparison
-    df["Acc. No."] = df["Acc. No."].astype(str)  # Converts the Acc. No. column to string type
-    df_to_process = df[~df["Acc. No."].isin(processed_ids)] # Selects only rows whose Acc. No. is not already processed
+    # Filter DF - Acc. No. is already read as a string
+    df = df[~df["Acc. No."].isin(processed_ids)].copy() # Selects only rows whose Acc. No. is not already processed
+    for column in ("Title", "Author/Editor"):
+        df[column] = clean_column(df[column]) if column in df else ""
+    df_to_process = df[df["Title"].str.len() >= MIN_TITLE_LENGTH] # nothing meaningful to search for in shorter titles
     
     if args.limit:
         df_to_process = df_to_process.head(args.limit) # Limits the number of books to process
     
     print(f"Processing {len(df_to_process)} records...", flush=True)
 
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS) # Limits the number of concurrent requests   
-    
-    async with aiohttp.ClientSession() as session:
+    # One pooled connector for the whole run, capped at the worker count: connections to
+    # googleapis.com are kept alive and DNS is resolved once, instead of re-handshaking per request
+    connector = aiohttp.TCPConnector(
+        limit=args.concurrency,
+        limit_per_host=args.concurrency,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        enable_cleanup_closed=True
+    )
+    async with aiohttp.ClientSession(connector=connector, timeout=REQUEST_TIMEOUT) as session:
         rows = df_to_process.to_dict('records')
         total_processed = 0
+
+        # Pipeline: a feeder fills a bounded queue, --concurrency workers fetch continuously
+        # (a slow lookup never holds back the others), and results are written here in input
+        # order, so reruns and the first-wins dedup downstream see the same file
+        row_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        result_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        state = IngestionState(session, RateLimiter(args.rate))
+        workers = [
+            asyncio.create_task(fetch_worker(state, row_queue, result_queue))
+            for _ in range(args.concurrency)
+        ]
+        window = asyncio.Semaphore(REORDER_WINDOW)
+        feeder = asyncio.create_task(feed_rows(rows, row_queue, len(workers), window))
         
-        for i in range(0, len(rows), SAVE_INTERVAL):
-            batch = rows[i:i+SAVE_INTERVAL]
-            batch_tasks = [process_book(session, row, semaphore) for row in batch]
-            
-            batch_results = await asyncio.gather(*batch_tasks)
-            
-            with open(args.output, "a", encoding='utf-8') as f:
-                for res in batch_results:
-                    if res:
-                        f.write(json.dumps(res) + "\n")
-            
-            total_processed += len(batch_results)
-            print(f"Processed {total_processed}/{len(rows)} across all batches...", flush=True)
+        with open(args.output, "ab", buffering=WRITE_BUFFER_SIZE) as f:
+            pending = bytearray()
+            ready = {}    # results that finished ahead of an earlier row, by row index
+            running = len(workers)
+            while running:
+                item = await result_queue.get()
+                if item is WORKER_DONE:
+                    running -= 1
+                    continue
+                if isinstance(item, Exception):
+                    f.write(pending)
+                    for task in (feeder, *workers):
+                        task.cancel()
+                    raise item
+                index, res = item
+                ready[index] = res
+                while total_processed in ready:
+                    pending += orjson.dumps(ready.pop(total_processed))
+                    pending += b"\n"
+                    total_processed += 1
+                    window.release()
+                    
+                    # One write every SAVE_INTERVAL records; flushed so a crash loses at most that many
+                    if total_processed % SAVE_INTERVAL == 0 or total_processed == len(rows):
+                        f.write(pending)
+                        f.flush()
+                        pending.clear()
+                        print(f"Processed {total_processed}/{len(rows)}...", flush=True)
+            f.write(pending)
+
+        # Re-raises any error that stopped the feeder or a worker early
+        await asyncio.gather(feeder, *workers)
 
     print("Done.")
 
@@ -4,7 +4,6 @@ import sys
 import os
 import logging
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 def run_step(command, step_name):
@@ -44,28 +43,19 @@ def run_step(command, step_name):
         logger.error(f"Error executing {step_name}: {e}")
         return False
 
-def main():
-    parser = argparse.ArgumentParser(description="Book Finder Pipeline Orchestrator")
-    parser.add_argument("--skip-sync", action="store_true", help="Skip the sync step")
-    parser.add_argument("--skip-ingestion", action="store_true", help="Skip the ingestion step")
-    parser.add_argument("--skip-transform", action="store_true", help="Skip the data transformation step")
-    parser.add_argument("--skip-storage", action="store_true", help="Skip the database storage step")
-    parser.add_argument("--ingest-limit", type=int, default=50, help="Limit number of books to ingest")
-    
-    args = parser.parse_args()
-
+def run_pipeline(skip_sync=False, skip_ingestion=False, skip_transform=False, skip_storage=False, ingest_limit=50):
+    """Runs the pipeline steps in order. Returns True on success, False if a step failed."""
     logger.info("Starting Pipeline Orchestration...")
     
     ingestion_input = "data/raw/Accession Register-Books.csv"
     
     # 1. Sync Step
-    if not args.skip_sync:
+    if not skip_sync:
         sync_cmd = f"{sys.executable} sync_pipeline.py"
         logger.info("Step 1: Synchronizing with OPAC...")
         
         # Run sync manually to check exit code
-        import subprocess as sp
-        sync_process = sp.run(sync_cmd, shell=True, cwd=os.getcwd())
+        sync_process = subprocess.run(sync_cmd, shell=True, cwd=os.getcwd())
         sync_code = sync_process.returncode
         
         if sync_code == 2:
@@ -79,27 +69,45 @@ def main():
             logger.info("Checking if any pending records in main backlog (limited to 5 for speed)...")
         else:
             logger.error("Sync failed. Check logs for details.")
-            sys.exit(1)
+            return False
     else:
         logger.info("Skipping Sync Step.")
 
     steps = []
     
-    if not args.skip_ingestion:
-        steps.append((f"{sys.executable} ingestion/ingestion.py --input '{ingestion_input}' --limit {args.ingest_limit}", "Google Books Ingestion"))
+    if not skip_ingestion:
+        steps.append((f"{sys.executable} ingestion/ingestion.py --input '{ingestion_input}' --limit {ingest_limit}", "Google Books Ingestion"))
     
-    if not args.skip_transform:
+    if not skip_transform:
         steps.append((f"{sys.executable} Transformation/transformation.py", "Data Transformation"))
         
-    if not args.skip_storage:
+    if not skip_storage:
         steps.append((f"{sys.executable} storage/storage.py", "Database Storage"))
     
     for cmd, name in steps:
         if not run_step(cmd, name):
             logger.error(f"{name} failed. Pipeline stopped.")
-            sys.exit(1)
+            return False
             
     logger.info("Pipeline executed successfully.")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Book Finder Pipeline Orchestrator")
+    parser.add_argument("--skip-sync", action="store_true", help="Skip the sync step")
+    parser.add_argument("--skip-ingestion", action="store_true", help="Skip the ingestion step")
+    parser.add_argument("--skip-transform", action="store_true", help="Skip the data transformation step")
+    parser.add_argument("--skip-storage", action="store_true", help="Skip the database storage step")
+    parser.add_argument("--ingest-limit", type=int, default=50, help="Limit number of books to ingest")
+    
+    args = parser.parse_args()
+
+    # Configured only when run as a script, so importing run_pipeline (e.g. from the API)
+    # leaves the host process's logging alone
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if not run_pipeline(args.skip_sync, args.skip_ingestion, args.skip_transform, args.skip_storage, args.ingest_limit):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
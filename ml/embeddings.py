@@ -2,11 +2,26 @@ from sentence_transformers import SentenceTransformer
 import chromadb
 from chromadb.utils import embedding_functions
 import os
+from bisect import bisect_right
+from functools import lru_cache
 
 # --- Configuration ---
 MODEL_NAME = "all-MiniLM-L6-v2"
 DB_PATH = "data/vector_store"
 COLLECTION_NAME = "books"
+# HNSW graph settings, applied when the collection is created (index_books.py --reindex
+# recreates it): a denser graph and larger candidate lists than Chroma's defaults
+# (M=16, construction_ef=100, search_ef=10)
+HNSW_SETTINGS = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 32,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 64,
+}
+# Number of distinct query vectors kept in memory
+QUERY_CACHE_SIZE = 4096
+# Texts per model forward pass when indexing
+ENCODE_BATCH_SIZE = 256
 
 class EmbeddingManager:
     def __init__(self):
@@ -25,12 +40,29 @@ class EmbeddingManager:
         self.model = self.embedding_fn._model
         
         # Get or create the collection
-        self.collection = self.client.get_or_create_collection(
+        self.collection = self._get_collection()
+
+        # Per-instance LRU of query text -> embedding, so repeated queries skip the model
+        self.embed_query = lru_cache(maxsize=QUERY_CACHE_SIZE)(self._embed_query)
+
+    def _get_collection(self):
+        return self.client.get_or_create_collection(
             name=COLLECTION_NAME,
             embedding_function=self.embedding_fn,
-            metadata={"hnsw:space": "cosine"}
+            metadata=HNSW_SETTINGS
         )
 
+    def reset_index(self):
+        """
+        Drops the collection and creates it empty. Chroma only reads HNSW settings at
+        creation, so this is how an existing index picks up changes to HNSW_SETTINGS.
+        """
+        self.client.delete_collection(COLLECTION_NAME)
+        self.collection = self._get_collection()
+
+    def _embed_query(self, query_text):
+        return self.model.encode(query_text).tolist()
+
     def generate_embeddings(self, texts):
         """
         Generates embeddings for a list of strings.
@@ -40,22 +72,54 @@ class EmbeddingManager:
     def add_to_index(self, ids, texts, metadatas=None):
         """
         Adds documents to the vector index.
+        Texts are encoded here in large batches, so Chroma does not run the model itself.
+        Only vectors and metadata are stored: full records are read from SQLite.
         """
+        embeddings = self.model.encode(texts, batch_size=ENCODE_BATCH_SIZE, show_progress_bar=False)
         self.collection.upsert(
             ids=ids,
-            documents=texts,
+            embeddings=embeddings.tolist(),
             metadatas=metadatas
         )
 
+    def indexed_book_ids(self):
+        """Returns {document id: SQLite book id} for every document in the vector index."""
+        result = self.collection.get(include=["metadatas"])
+        return {
+            doc_id: (meta or {}).get("book_id")
+            for doc_id, meta in zip(result["ids"], result["metadatas"])
+        }
+
+    def update_metadata(self, ids, metadatas):
+        """Replaces the metadata of existing documents; their vectors are kept (no re-encoding)."""
+        self.collection.update(ids=ids, metadatas=metadatas)
+
+    def remove_from_index(self, ids):
+        self.collection.delete(ids=ids)
+
     def search(self, query_text, n_results=10):
         """
         Searches the index for the most similar documents.
+        Query embeddings are cached; results are not, so index updates show up at once
+        (the API and app cache results themselves, with TTLs).
         """
-        results = self.collection.query(
-            query_texts=[query_text],
-            n_results=n_results
+        return self.collection.query(
+            query_embeddings=[self.embed_query(query_text.strip())],
+            n_results=n_results,
+            include=["metadatas", "distances"]
         )
-        return results
+
+    def search_book_ids(self, query_text, n_results=10, max_distance=None):
+        """
+        Returns the SQLite book ids of the nearest documents, most similar first.
+        Chroma returns distances in ascending order, so the max_distance cut is a binary search.
+        """
+        results = self.search(query_text, n_results=n_results)
+        metadatas = results.get("metadatas", [[]])[0]
+        if max_distance is not None:
+            distances = results.get("distances", [[]])[0]
+            metadatas = metadatas[:bisect_right(distances, max_distance)]
+        return [meta["book_id"] for meta in metadatas if meta and "book_id" in meta]
 
 if __name__ == "__main__":
     # Quick test
@@ -1,5 +1,7 @@
+import argparse
 import sys
 import os
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 # Add project root to sys.path
@@ -26,40 +28,70 @@ def prepare_book_text(book):
     
     return " | ".join(parts)
 
-def index_all_books():
+def book_metadata(book):
+    # Meta information to help reconstruct or filter; book_id is what search results resolve to
+    return {
+        "book_id": book.id,
+        "title": book.title or "",
+        "isbn_13": book.isbn_13 or ""
+    }
+
+def index_all_books(reindex=False):
     print("Initializing Database and Embedding Manager...")
     session = db.SessionLocal()
     manager = EmbeddingManager()
     
-    print("Fetching books from SQLite...")
-    books = session.query(db.Book).all()
-    print(f"Found {len(books)} books.")
+    # Only books missing from ChromaDB are encoded, so interrupted runs resume where they stopped.
+    # Books already indexed only get their book_id refreshed if SQLite assigned a new primary key
+    # (e.g. after books.db was rebuilt), which needs no re-encoding.
+    if reindex:
+        print("Dropping the existing index...")
+        manager.reset_index()
+    indexed = manager.indexed_book_ids()
+    print(f"{len(indexed)} books already indexed.")
     
     ids = []
     texts = []
     metadatas = []
+    moved_ids = []
+    moved_metadatas = []
+    seen = set()
     
-    batch_size = 100
+    batch_size = 512
+    added = 0
+    updated = 0
+    
+    print("Fetching books from SQLite...")
+    # Plain rows of just the indexed columns, streamed in primary-key order
+    stmt = select(
+        db.Book.id, db.Book.isbn_13, db.Book.google_id,
+        db.Book.title, db.Book.subtitle, db.Book.authors, db.Book.categories, db.Book.description
+    ).order_by(db.Book.id).execution_options(yield_per=batch_size)
+    books = session.execute(stmt)
     
-    for i, book in enumerate(books):
+    for book in books:
         # We use ISBN_13 or Google ID as a stable identifier in ChromaDB
         doc_id = book.isbn_13 or book.google_id or str(book.id)
-        text = prepare_book_text(book)
-        
-        # Meta information to help reconstruct or filter
-        meta = {
-            "book_id": book.id,
-            "title": book.title or "",
-            "isbn_13": book.isbn_13 or ""
-        }
+        seen.add(doc_id)
+        if doc_id in indexed:
+            if indexed[doc_id] != book.id:
+                moved_ids.append(doc_id)
+                moved_metadatas.append(book_metadata(book))
+                if len(moved_ids) >= batch_size:
+                    updated += len(moved_ids)
+                    manager.update_metadata(moved_ids, moved_metadatas)
+                    moved_ids = []
+                    moved_metadatas = []
+            continue
         
         ids.append(doc_id)
-        texts.append(text)
-        metadatas.append(meta)
+        texts.append(prepare_book_text(book))
+        metadatas.append(book_metadata(book))
         
         # Upsert in batches
         if len(ids) >= batch_size:
-            print(f"Indexing batch {i+1}/{len(books)}...")
+            added += len(ids)
+            print(f"Indexing batch ({added} books so far)...")
             manager.add_to_index(ids, texts, metadatas)
             ids = []
             texts = []
@@ -67,11 +99,24 @@ def index_all_books():
             
     # Remaining
     if ids:
+        added += len(ids)
         print(f"Indexing final batch...")
         manager.add_to_index(ids, texts, metadatas)
+    if moved_ids:
+        updated += len(moved_ids)
+        manager.update_metadata(moved_ids, moved_metadatas)
+
+    # Documents whose book is gone would otherwise resolve to whatever row now has their old id
+    stale = [doc_id for doc_id in indexed if doc_id not in seen]
+    for i in range(0, len(stale), batch_size):
+        manager.remove_from_index(stale[i:i + batch_size])
         
-    print("Indexing complete.")
+    print(f"Indexing complete. {added} books added, {updated} book ids refreshed, {len(stale)} removed.")
     session.close()
 
 if __name__ == "__main__":
-    index_all_books()
+    parser = argparse.ArgumentParser(description="Index books into the vector store")
+    parser.add_argument("--reindex", action="store_true", help="Drop and rebuild the whole index (applies HNSW_SETTINGS and rewrites every entry)")
+    args = parser.parse_args()
+
+    index_all_books(args.reindex)
@@ -1,14 +1,35 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, event, case, select, Column, Integer, String, Text, text
+from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
 
 # The database file location relative to the project root
 SQLALCHEMY_DATABASE_URL = "sqlite:///./data/books.db"
 
 # connect_args={"check_same_thread": False} is needed only for SQLite
+# A single shared pool sized for the API threadpool
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False},
+    pool_size=20, max_overflow=10
 )
+
+# Read-heavy tuning: WAL lets readers run alongside the pipeline's writes,
+# and the DB file is memory-mapped instead of copied through the page cache
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+]
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Thread-local sessions for long-lived multi-threaded callers (the Streamlit app)
+ScopedSession = scoped_session(SessionLocal)
 
 Base = declarative_base()
 
@@ -20,7 +41,7 @@ class Book(Base):
     subtitle = Column(String, nullable=True)
     authors = Column(String)  # Stored as comma-separated string
     isbn_13 = Column(String, unique=True, index=True)
-    isbn_10 = Column(String, nullable=True)
+    isbn_10 = Column(String, nullable=True, index=True)
     categories = Column(String, nullable=True)
     description = Column(Text, nullable=True)
     thumbnail = Column(String, nullable=True)
@@ -34,7 +55,133 @@ class Book(Base):
     publisher_info = Column(String, nullable=True)
     book_no = Column(String, nullable=True)
 
+# Full-text index over the text columns, kept in sync with `books` by triggers.
+# The trigram tokenizer matches arbitrary substrings (like LIKE '%q%'), case-insensitively.
+SEARCH_INDEX_COLUMNS = "title, subtitle, authors"
+SEARCH_INDEX_TABLE_DDL = (
+    "CREATE VIRTUAL TABLE books_fts USING fts5("
+    f"{SEARCH_INDEX_COLUMNS}, content='books', content_rowid='id', tokenize='trigram')"
+)
+SEARCH_INDEX_TRIGGERS = {
+    "books_ai": f"""CREATE TRIGGER books_ai AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, {SEARCH_INDEX_COLUMNS}) VALUES (new.id, new.title, new.subtitle, new.authors);
+    END""",
+    "books_ad": f"""CREATE TRIGGER books_ad AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, {SEARCH_INDEX_COLUMNS}) VALUES ('delete', old.id, old.title, old.subtitle, old.authors);
+    END""",
+    "books_au": f"""CREATE TRIGGER books_au AFTER UPDATE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, {SEARCH_INDEX_COLUMNS}) VALUES ('delete', old.id, old.title, old.subtitle, old.authors);
+        INSERT INTO books_fts(rowid, {SEARCH_INDEX_COLUMNS}) VALUES (new.id, new.title, new.subtitle, new.authors);
+    END""",
+}
+
+def init_search_index(bind=engine):
+    """
+    Creates the FTS5 search index and its triggers. An index built with a different
+    definition is dropped and recreated; a new index is filled from `books`.
+    """
+    with bind.begin() as conn:
+        current = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'books_fts'")).scalar()
+        if current == SEARCH_INDEX_TABLE_DDL:
+            return
+        for name in SEARCH_INDEX_TRIGGERS:
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        conn.execute(text("DROP TABLE IF EXISTS books_fts"))
+        conn.execute(text(SEARCH_INDEX_TABLE_DDL))
+        for statement in SEARCH_INDEX_TRIGGERS.values():
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO books_fts(books_fts) VALUES ('rebuild')"))
+
+# Trigram indexes cannot match terms shorter than one trigram
+FTS_MIN_TERM_LENGTH = 3
+
+def fts_query(q):
+    """
+    Turns free text into an FTS5 query: every word is quoted (so operators and
+    punctuation are matched literally) and matched as a substring, and all words must
+    match. Words too short for the trigram index are ignored, unless nothing else is
+    left, in which case the whole query is matched as one substring.
+    Title, subtitle and authors are searched.
+    """
+    words = [word for word in q.split() if len(word) >= FTS_MIN_TERM_LENGTH] or [q.strip()]
+    terms = ['"{}"'.format(word.replace('"', '""')) for word in words]
+    return "{title subtitle authors}: (" + " ".join(terms) + ")"
+
+# Exact ISBN hit first, then full-text matches by BM25 rank
+KEYWORD_SEARCH_HITS = """
+    SELECT id, 0 AS branch, 0.0 AS score FROM books WHERE isbn_13 = :isbn
+    UNION ALL
+    SELECT books_fts.rowid, 1, books_fts.rank FROM books_fts
+    JOIN books ON books.id = books_fts.rowid
+    WHERE books_fts MATCH :q AND books.isbn_13 IS NOT :isbn
+"""
+# Queries shorter than a trigram (e.g. "AI", "Go") cannot use the index: plain substring scan
+SHORT_KEYWORD_SEARCH_HITS = """
+    SELECT id, 0 AS branch, 0.0 AS score FROM books WHERE isbn_13 = :isbn
+    UNION ALL
+    SELECT id, 1, 0.0 FROM books
+    WHERE (title LIKE :q ESCAPE '\\' OR authors LIKE :q ESCAPE '\\') AND isbn_13 IS NOT :isbn
+"""
+
+def keyword_statements(hits):
+    search = text(f"""
+        SELECT books.* FROM ({hits}) AS hits
+        JOIN books ON books.id = hits.id
+        ORDER BY hits.branch, hits.score, hits.id
+        LIMIT :n OFFSET :o
+    """)
+    return search, text(f"SELECT count(*) FROM ({hits})")
+
+KEYWORD_SEARCH_SQL, KEYWORD_COUNT_SQL = keyword_statements(KEYWORD_SEARCH_HITS)
+SHORT_KEYWORD_SEARCH_SQL, SHORT_KEYWORD_COUNT_SQL = keyword_statements(SHORT_KEYWORD_SEARCH_HITS)
+
+def like_pattern(q):
+    """LIKE pattern matching q as a literal substring."""
+    escaped = q.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def keyword_query(q):
+    """(search SQL, count SQL, parameters) for q: full-text search, or a LIKE scan for very short queries."""
+    if len(q.strip()) < FTS_MIN_TERM_LENGTH:
+        return SHORT_KEYWORD_SEARCH_SQL, SHORT_KEYWORD_COUNT_SQL, {"isbn": q, "q": like_pattern(q)}
+    return KEYWORD_SEARCH_SQL, KEYWORD_COUNT_SQL, {"isbn": q, "q": fts_query(q)}
+
+def keyword_search(session, q, limit=None, offset=0):
+    """
+    Keyword search shared by the API and the Streamlit app: title/subtitle/author
+    full-text search (substring matching) plus exact ISBN-13, one page of row mappings.
+    Queries under three characters fall back to a title/author substring scan;
+    a blank query matches nothing.
+    """
+    if not q.strip():
+        return []
+    search_sql, _, params = keyword_query(q)
+    params.update(n=limit if limit is not None else -1, o=offset)
+    return session.execute(search_sql, params).mappings().all()
+
+def count_keyword_matches(session, q):
+    """Total number of keyword_search results for q."""
+    if not q.strip():
+        return 0
+    _, count_sql, params = keyword_query(q)
+    return session.execute(count_sql, params).scalar()
+
+def books_by_ids(session, book_ids):
+    """Row mappings for the given primary keys, ordered as given (e.g. by vector-search relevance)."""
+    if not book_ids:
+        return []
+    position = case({book_id: i for i, book_id in enumerate(book_ids)}, value=Book.id)
+    stmt = select(*Book.__table__.c).where(Book.id.in_(book_ids)).order_by(position)
+    return session.execute(stmt).mappings().all()
+
+def init_db(bind=engine):
+    """Creates missing tables and indexes (also on existing tables), then the search index."""
+    Base.metadata.create_all(bind=bind)
+    for index in Book.__table__.indexes:
+        index.create(bind=bind, checkfirst=True)
+    init_search_index(bind)
+
 if __name__ == "__main__":
     # Create tables
-    Base.metadata.create_all(bind=engine)
+    init_db()
     print("Database initialized (SQLAlchemy).")
@@ -21,7 +21,7 @@ def ingest_to_db(input_file):
         return
 
     # Ensure tables exist
-    db.Base.metadata.create_all(bind=db.engine)
+    db.init_db()
     
     session = db.SessionLocal()
     
@@ -108,17 +108,19 @@ def parse_and_append(bib_file: str, csv_path: str) -> int:
         return 0
 
     # Load existing CSV to check for duplicates
+    # Only the header and the Acc. No. column are needed, so avoid loading the whole register
     if os.path.exists(csv_path):
         try:
-            df_existing = pd.read_csv(csv_path)
-            # Ensure Acc. No. is string for comparison
-            existing_acc_nos = set(df_existing['Acc. No.'].astype(str).tolist())
+            columns = pd.read_csv(csv_path, nrows=0).columns
+            # Read as strings for comparison
+            df_existing = pd.read_csv(csv_path, usecols=['Acc. No.'], dtype=str, keep_default_na=False)
+            existing_acc_nos = set(df_existing['Acc. No.'].tolist())
         except Exception as e:
             logger.error(f"Error reading existing CSV: {e}")
             return 0
     else:
         existing_acc_nos = set()
-        df_existing = pd.DataFrame(columns=["Acc. No.", "Author/Editor", "Title"])
+        columns = ["Acc. No.", "Author/Editor", "Title"]
 
     new_rows = []
     
@@ -144,7 +146,7 @@ def parse_and_append(bib_file: str, csv_path: str) -> int:
     if new_rows:
         df_new = pd.DataFrame(new_rows)
         # Create full DF with all columns from existing
-        df_final = pd.DataFrame(new_rows, columns=df_existing.columns)
+        df_final = pd.DataFrame(new_rows, columns=columns)
         
         # Append to main CSV
         output_mode = 'a'
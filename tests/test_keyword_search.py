@@ -0,0 +1,80 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Add project root to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import db
+
+
+@pytest.fixture
+def session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'books.db'}")
+    db.init_db(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([
+        db.Book(title="Python Programming", authors="Guido van Rossum", isbn_13="9780000000001", google_id="g1"),
+        db.Book(title="Fluent Python", authors="Luciano Ramalho", isbn_13="9780000000002", google_id="g2"),
+        db.Book(title="AI: A Modern Approach", authors="Stuart Russell", isbn_13="9780000000003", google_id="g3"),
+        db.Book(title="100% Go", authors="Jane Doe", isbn_13="9780000000004", google_id="g4"),
+        db.Book(title="snake_case Style", authors="Ann Other", isbn_13="9780000000005", google_id="g5"),
+        db.Book(title="Unrelated", authors="Python Press", isbn_13="9780000000006", google_id="g6"),
+    ])
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def titles(rows):
+    return [row["title"] for row in rows]
+
+
+def test_full_text_search_matches_substrings_case_insensitively(session):
+    assert set(titles(db.keyword_search(session, "PYTHON"))) == {
+        "Python Programming", "Fluent Python", "Unrelated"
+    }
+    assert titles(db.keyword_search(session, "progr")) == ["Python Programming"]
+
+
+def test_short_query_falls_back_to_like(session):
+    assert titles(db.keyword_search(session, "AI")) == ["AI: A Modern Approach"]
+    assert db.count_keyword_matches(session, "AI") == 1
+
+
+def test_short_query_escapes_like_wildcards(session):
+    # Unescaped, "%" and "_" would match every title
+    assert titles(db.keyword_search(session, "%")) == ["100% Go"]
+    assert titles(db.keyword_search(session, "_")) == ["snake_case Style"]
+    assert db.count_keyword_matches(session, "_") == 1
+
+
+def test_blank_query_matches_nothing(session):
+    assert db.keyword_search(session, "   ") == []
+    assert db.count_keyword_matches(session, "   ") == 0
+
+
+def test_isbn_match_comes_first(session):
+    # The ISBN also appears in a title, so it is a full-text hit as well
+    session.add(db.Book(title="Notes on 9780000000002", authors="X", isbn_13="9780000000007", google_id="g7"))
+    session.commit()
+    rows = db.keyword_search(session, "9780000000002")
+    assert titles(rows) == ["Fluent Python", "Notes on 9780000000002"]
+    assert db.count_keyword_matches(session, "9780000000002") == 2
+
+
+def test_count_matches_the_pages(session):
+    total = db.count_keyword_matches(session, "python")
+    pages = [db.keyword_search(session, "python", limit=2, offset=offset) for offset in range(0, 6, 2)]
+    ids = [row["id"] for page in pages for row in page]
+    assert total == len(ids) == 3
+    assert len(set(ids)) == total
+
+
+def test_fts_query_quotes_words_and_drops_short_ones():
+    assert db.fts_query('a python or say"hi') == '{title subtitle authors}: ("python" "say""hi")'
+    assert db.fts_query("AI") == '{title subtitle authors}: ("AI")'